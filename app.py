@@ -1,13 +1,23 @@
 
 import streamlit as st
 from yt_dlp import YoutubeDL
-import uuid
 import tempfile
 import os
+from functools import partial
 from urllib.parse import urlparse
 
+from player import tv_player
+from resolver import BREAKER, refresh_stream, remember
+from telemetry import COLLECTOR, render_dashboard
+
 # 頁面設定
 st.set_page_config(page_title="綠的電視", layout="wide")
+
+# 網址加上 ?qoe=1 時只顯示播放品質統計
+if st.query_params.get("qoe"):
+    render_dashboard()
+    st.stop()
+
 st.title("自動播放，左右切換頻道")
 st.write("頁面載入後自動從三立新聞開始播放；使用左右名稱點擊、鍵盤左右鍵或滑動切換頻道。若直播需要登入驗證，請上傳 cookies.txt（Netscape 格式）。")
 
@@ -63,6 +73,11 @@ def choose_best_m3u8(formats: list):
     candidates.sort(key=score, reverse=True)
     return candidates[0]
 
+def probe_channel(url: str):
+    """背景重試用：不帶 cookies 重新擷取，回傳 m3u8 網址或 None。"""
+    best = choose_best_m3u8(fetch_info(url).get("formats") or [])
+    return best.get("url") if best else None
+
 # cookies 上傳（選用）
 uploaded_cookies = st.file_uploader("（選擇性）上傳 YouTube cookies.txt（Netscape 格式）以供抓取時使用", type=["txt"])
 
@@ -86,6 +101,12 @@ if "tv_channels" not in st.session_state:
             item["error"] = "非 YouTube 連結"
             results.append(item)
             continue
+        # 斷路器打開（近期失敗、背景重試中）的頻道不擷取，直接顯示原因
+        blocked = BREAKER.blocked(url, with_cookies=bool(cookiefile_path))
+        if blocked:
+            item["error"] = blocked
+            results.append(item)
+            continue
         try:
             info = fetch_info(url, cookiefile=cookiefile_path)
             formats = info.get("formats") or []
@@ -96,6 +117,13 @@ if "tv_channels" not in st.session_state:
                 item["error"] = "找不到 m3u8/HLS 格式"
         except Exception as e:
             item["error"] = str(e)
+        if item["best_url"]:
+            BREAKER.record_success(url)
+            # 帶 cookies 取得的網址只給這個 session，不放進跨 session 的快取
+            if not cookiefile_path:
+                remember(url, item["best_url"])
+        else:
+            BREAKER.record_failure(url, item["error"], probe=partial(probe_channel, url))
         results.append(item)
 
     if cookiefile_path and os.path.exists(cookiefile_path):
@@ -106,6 +134,30 @@ if "tv_channels" not in st.session_state:
 
     st.session_state["tv_channels"] = results
 
+def refresh_channel(channel_id: str, stale_url: str):
+    """串流網址過期時只重新解析該頻道，優先使用其他 session 剛解析好的網址。"""
+    def resolve():
+        cookiefile_path = None
+        if uploaded_cookies:
+            tmp = tempfile.NamedTemporaryFile(delete=False)
+            tmp.write(uploaded_cookies.getbuffer())
+            tmp.close()
+            cookiefile_path = tmp.name
+        try:
+            best = choose_best_m3u8(fetch_info(channel_id, cookiefile=cookiefile_path).get("formats") or [])
+            return best.get("url") if best else None
+        finally:
+            if cookiefile_path and os.path.exists(cookiefile_path):
+                os.remove(cookiefile_path)
+
+    new_url = refresh_stream(channel_id, stale_url, resolve, probe=partial(probe_channel, channel_id),
+                             with_cookies=bool(uploaded_cookies))
+    if new_url:
+        for c in st.session_state.get("tv_channels", []):
+            if c["input_url"] == channel_id:
+                c["best_url"] = new_url
+    return new_url
+
 # 顯示播放器
 channels = st.session_state.get("tv_channels", [])
 playable = [c for c in channels if c.get("best_url")]
@@ -116,94 +168,14 @@ if not playable:
     for u in unavailable:
         st.write(f"- {u['name']}: {u.get('error')}")
 else:
-    player_list = [{"name": c["name"], "url": c["best_url"]} for c in playable]
-    player_id = "player_" + uuid.uuid4().hex[:8]
-
-    html = f"""
-    <div style="display:flex;flex-direction:column;align-items:center;">
-      <video id="{player_id}" controls autoplay playsinline style="width:100%;max-width:960px;height:auto;background:black;"></video>
-
-      <!-- 三欄顯示：左(上一頻道) 中(目前頻道) 右(下一頻道) -->
-      <div style="margin-top:16px;display:flex;align-items:center;justify-content:center;font-size:24px;font-weight:bold;">
-        <div id="{player_id}_prev" style="cursor:pointer;color:#007bff;margin-right:40px;">{player_list[-1]['name']}</div>
-        <div id="{player_id}_current" style="margin:0 40px;color:red;-webkit-text-stroke:1px white;text-shadow:0 0 2px white;font-weight:bold;">
-            {player_list[0]['name']}
-        </div>
-        <div id="{player_id}_next" style="cursor:pointer;color:#007bff;margin-left:40px;">{player_list[1]['name']}</div>
-      </div>
-    </div>
-
-    https://cdn.jsdelivr.net/npm/hls.js@1.4.0/dist/hls.min.js</script>
-    <script>
-    (function(){{
-        const list = {player_list!r};
-        let idx = 0;
-        const video = document.getElementById("{player_id}");
-        const prevName = document.getElementById("{player_id}_prev");
-        const nextName = document.getElementById("{player_id}_next");
-        const currentName = document.getElementById("{player_id}_current");
-
-        function updateUI(){{
-            prevName.innerText = list[(idx-1+list.length)%list.length].name;
-            currentName.innerText = list[idx].name;
-            nextName.innerText = list[(idx+1)%list.length].name;
-        }}
-
-        function attachHls(url){{
-            if(video.canPlayType('application/vnd.apple.mpegurl')){{
-                video.src = url;
-            }} else if(Hls.isSupported()){{
-                if(window._hls_instance){{window._hls_instance.destroy();}}
-                const hls = new Hls();
-                window._hls_instance = hls;
-                hls.loadSource(url);
-                hls.attachMedia(video);
-            }} else {{
-                video.src = url;
-            }}
-        }}
-
-        async function loadSrc(url){{
-            video.muted = false;
-            attachHls(url);
-            try{{await video.play();}}catch(e){{}}
-        }}
-
-        function gotoIndex(newIdx){{
-            idx = (newIdx+list.length)%list.length;
-            updateUI();
-            loadSrc(list[idx].url);
-        }}
-
-        prevName.addEventListener('click', ()=>gotoIndex(idx-1));
-        nextName.addEventListener('click', ()=>gotoIndex(idx+1));
-
-        document.addEventListener('keydown', e=>{{
-            if(e.key==="ArrowLeft") gotoIndex(idx-1);
-            if(e.key==="ArrowRight") gotoIndex(idx+1);
-        }});
-
-        let startX=null;
-        video.addEventListener('touchstart', e=>{{startX=e.touches[0].clientX;}});
-        video.addEventListener('touchend', e=>{{
-            const endX=e.changedTouches[0].clientX;
-            if(startX && Math.abs(endX-startX)>50){{
-                if(endX<startX) gotoIndex(idx+1); else gotoIndex(idx-1);
-            }}
-            startX=null;
-        }});
-
-        updateUI();
-        loadSrc(list[0].url);
-    }})();
-    </script>
-    """
-
-    st.components.v1.html(html, height=700)
+    # 播放器只掛載一次，之後 rerun 只送出增量更新
+    player_list = [{"id": c["input_url"], "name": c["name"], "url": c["best_url"]} for c in playable]
+    tv_player(player_list, layout="names", height=700, on_refresh=refresh_channel,
+              on_beacon=lambda b: COLLECTOR.ingest("app.py", b))
 
     if unavailable:
         st.markdown("**不可用或需驗證的頻道**")
         for u in unavailable:
             st.write(f"- {u['name']}: {u.get('error')}")
 
-    st.info("若某台需要登入驗證，請上傳 cookies.txt 並重新整理頁面以讓伺服器抓取帶 cookies 的 m3u8。")
+    st.info("若某台需要登入驗證，請上傳 cookies.txt 並重新整理頁面以讓伺服器抓取帶 cookies 的 m3u8。串流網址過期時播放器會自動重新取得該台網址，不需重新整理。")
@@ -1,13 +1,23 @@
 # app.py
 import streamlit as st
 from yt_dlp import YoutubeDL
-import uuid
 import tempfile
 import os
+from functools import partial
 from urllib.parse import urlparse
 import requests
 
+from player import tv_player
+from resolver import BREAKER, refresh_stream, remember
+from telemetry import COLLECTOR, render_dashboard
+
 st.set_page_config(page_title="不綠了電視", layout="wide")
+
+# 網址加上 ?qoe=1 時只顯示播放品質統計
+if st.query_params.get("qoe"):
+    render_dashboard()
+    st.stop()
+
 st.title("不綠了電視（自動播放，左右鍵切台）")
 st.write("頁面載入後自動從中天新聞開始播放；使用鍵盤左右鍵或按鈕切換頻道。若直播需要登入驗證，請上傳 cookies.txt（Netscape 格式）。")
 
@@ -69,6 +79,11 @@ def fetch_m3u8_text(url: str, timeout=10):
     resp.raise_for_status()
     return resp.text
 
+def probe_channel(url: str):
+    """背景重試用：不帶 cookies 重新擷取，回傳 m3u8 網址或 None。"""
+    best = choose_best_m3u8(fetch_info(url).get("formats") or [])
+    return best.get("url") if best else None
+
 # cookies 上傳（選用）
 uploaded_cookies = st.file_uploader("（選擇性）上傳 YouTube cookies.txt（Netscape 格式）以供抓取時使用", type=["txt"])
 
@@ -92,6 +107,12 @@ if "tv_channels" not in st.session_state:
             item["error"] = "非 YouTube 連結"
             results.append(item)
             continue
+        # 斷路器打開（近期失敗、背景重試中）的頻道不擷取，直接顯示原因
+        blocked = BREAKER.blocked(url, with_cookies=bool(cookiefile_path))
+        if blocked:
+            item["error"] = blocked
+            results.append(item)
+            continue
         try:
             info = fetch_info(url, cookiefile=cookiefile_path)
             formats = info.get("formats") or []
@@ -103,6 +124,13 @@ if "tv_channels" not in st.session_state:
                 item["error"] = "找不到 m3u8/HLS 格式"
         except Exception as e:
             item["error"] = str(e)
+        if item["best_url"]:
+            BREAKER.record_success(url)
+            # 帶 cookies 取得的網址只給這個 session，不放進跨 session 的快取
+            if not cookiefile_path:
+                remember(url, item["best_url"])
+        else:
+            BREAKER.record_failure(url, item["error"], probe=partial(probe_channel, url))
         results.append(item)
 
     # 清理暫存 cookie 檔
@@ -114,6 +142,30 @@ if "tv_channels" not in st.session_state:
 
     st.session_state["tv_channels"] = results
 
+def refresh_channel(channel_id: str, stale_url: str):
+    """串流網址過期時只重新解析該頻道，優先使用其他 session 剛解析好的網址。"""
+    def resolve():
+        cookiefile_path = None
+        if uploaded_cookies:
+            tmp = tempfile.NamedTemporaryFile(delete=False)
+            tmp.write(uploaded_cookies.getbuffer())
+            tmp.close()
+            cookiefile_path = tmp.name
+        try:
+            best = choose_best_m3u8(fetch_info(channel_id, cookiefile=cookiefile_path).get("formats") or [])
+            return best.get("url") if best else None
+        finally:
+            if cookiefile_path and os.path.exists(cookiefile_path):
+                os.remove(cookiefile_path)
+
+    new_url = refresh_stream(channel_id, stale_url, resolve, probe=partial(probe_channel, channel_id),
+                             with_cookies=bool(uploaded_cookies))
+    if new_url:
+        for c in st.session_state.get("tv_channels", []):
+            if c["input_url"] == channel_id:
+                c["best_url"] = new_url
+    return new_url
+
 # 顯示播放器（單一播放器，從第一台開始）
 channels = st.session_state.get("tv_channels", [])
 playable = [c for c in channels if c.get("best_url")]
@@ -125,133 +177,10 @@ if not playable:
         st.write(f"- {u['name']}: {u.get('error')}")
 else:
     # 保持原始順序，假設 CHANNELS 第一項為三立
-    player_list = [{"name": c["name"], "url": c["best_url"], "height": c.get("height")} for c in playable]
-
-    player_id = "player_" + uuid.uuid4().hex[:8]
-
-    html = f"""
-    <div style="display:flex;flex-direction:column;align-items:center;">
-      <div id="{player_id}_title" style="font-weight:600;margin-bottom:8px;">正在播放：{player_list[0]['name']}</div>
-      <video id="{player_id}" controls autoplay playsinline style="width:100%;max-width:960px;height:auto;background:black;"></video>
-      <div style="margin-top:8px;">
-        <button id="{player_id}_prev">◀ 上一台</button>
-        <button id="{player_id}_next">下一台 ▶</button>
-        <span id="{player_id}_info" style="margin-left:12px;"></span>
-      </div>
-      <div id="{player_id}_overlay" style="display:none;margin-top:8px;color:#c33;font-size:14px;">
-        自動播放被瀏覽器阻擋，請按播放並取消靜音以聽聲音。
-      </div>
-    </div>
-
-    <script src="https://cdn.jsdelivr.net/npm/hls.js@1.4.0/dist/hls.min.js"></script>
-    <script>
-    (function(){{
-        const list = {player_list!r};
-        let idx = 0;
-        const video = document.getElementById("{player_id}");
-        const title = document.getElementById("{player_id}_title");
-        const info = document.getElementById("{player_id}_info");
-        const prevBtn = document.getElementById("{player_id}_prev");
-        const nextBtn = document.getElementById("{player_id}_next");
-        const overlay = document.getElementById("{player_id}_overlay");
-
-        function updateInfo() {{
-            const cur = list[idx];
-            title.innerText = "正在播放：" + cur.name;
-            info.innerText = (cur.height ? (cur.height + "p") : "") ;
-        }}
-
-        function attachHls(url) {{
-            if (video.canPlayType('application/vnd.apple.mpegurl')) {{
-                video.src = url;
-            }} else if (Hls.isSupported()) {{
-                if (window._hls_instance) {{
-                    try {{ window._hls_instance.destroy(); }} catch(e){{}}
-                    window._hls_instance = null;
-                }}
-                const hls = new Hls();
-                window._hls_instance = hls;
-                hls.loadSource(url);
-                hls.attachMedia(video);
-            }} else {{
-                video.src = url;
-            }}
-        }}
-
-        async function loadSrc(url) {{
-            // 預設非靜音（若瀏覽器阻擋有聲自動播放，會顯示提示）
-            video.muted = false;
-            attachHls(url);
-            try {{
-                await video.play();
-                overlay.style.display = "none";
-            }} catch (err) {{
-                overlay.style.display = "block";
-            }}
-        }}
-
-        function gotoIndex(newIdx) {{
-            if (newIdx < 0) newIdx = list.length - 1;
-            if (newIdx >= list.length) newIdx = 0;
-            idx = newIdx;
-            updateInfo();
-            loadSrc(list[idx].url);
-        }}
-
-        prevBtn.addEventListener('click', ()=> gotoIndex(idx-1));
-        nextBtn.addEventListener('click', ()=> gotoIndex(idx+1));
-
-        // 雙擊影片切換全螢幕（手機上若無效也不影響）
-        const container = document.getElementById("{player_id}_title").parentElement;
-        video.addEventListener('dblclick', async () => {{
-            try {{
-                if (!document.fullscreenElement) {{
-                    if (container.requestFullscreen) {{
-                        await container.requestFullscreen();
-                    }} else if (container.webkitRequestFullscreen) {{
-                        container.webkitRequestFullscreen();
-                    }}
-                }} else {{
-                    if (document.exitFullscreen) {{
-                        await document.exitFullscreen();
-                    }} else if (document.webkitExitFullscreen) {{
-                        document.webkitExitFullscreen();
-                    }}
-                }}
-            }} catch (e) {{
-                console.warn('fullscreen error', e);
-            }}
-        }});
-
-        // 當進入或離開全螢幕時，確保鍵盤事件仍可用
-        document.addEventListener('fullscreenchange', () => {{
-            try {{
-                document.activeElement && document.activeElement.blur && document.activeElement.blur();
-                document.body.focus && document.body.focus();
-            }} catch(e){{}}
-        }});
-
-        // 鍵盤左右鍵切台（在全螢幕也有效）
-        document.addEventListener('keydown', function(e) {{
-            const tag = (document.activeElement && document.activeElement.tagName) || '';
-            if (tag === 'INPUT' || tag === 'TEXTAREA' || document.activeElement && document.activeElement.isContentEditable) {{
-                return;
-            }}
-            if (e.key === 'ArrowLeft') {{
-                gotoIndex(idx-1);
-            }} else if (e.key === 'ArrowRight') {{
-                gotoIndex(idx+1);
-            }}
-        }});
-
-        // 初始載入（從第一台開始）
-        updateInfo();
-        loadSrc(list[0].url);
-    }})();
-    </script>
-    """
-
-    st.components.v1.html(html, height=700)
+    # 播放器只掛載一次，之後 rerun 只送出增量更新
+    player_list = [{"id": c["input_url"], "name": c["name"], "url": c["best_url"], "height": c.get("height")} for c in playable]
+    tv_player(player_list, layout="buttons", height=700, on_refresh=refresh_channel,
+              on_beacon=lambda b: COLLECTOR.ingest("app2.py", b))
 
     # 顯示不可用頻道
     if unavailable:
@@ -259,4 +188,4 @@ else:
         for u in unavailable:
             st.write(f"- {u['name']}: {u.get('error')}")
 
-    st.info("若某台需要登入驗證，請上傳 cookies.txt 並重新整理頁面以讓伺服器抓取帶 cookies 的 m3u8。")
+    st.info("若某台需要登入驗證，請上傳 cookies.txt 並重新整理頁面以讓伺服器抓取帶 cookies 的 m3u8。串流網址過期時播放器會自動重新取得該台網址，不需重新整理。")
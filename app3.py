@@ -1,10 +1,21 @@
 # app.py (Part 1: Python backend)
 import streamlit as st
 from yt_dlp import YoutubeDL
-import tempfile, concurrent.futures, json, re
+import tempfile, concurrent.futures, re, os
+from functools import partial
 from html import escape
 
+from player import jukebox_player
+from resolver import BREAKER, refresh_stream, remember
+from telemetry import COLLECTOR, render_dashboard
+
 st.set_page_config(page_title="YouTube 點唱機（單欄）", layout="wide")
+
+# 網址加上 ?qoe=1 時只顯示播放品質統計
+if st.query_params.get("qoe"):
+    render_dashboard()
+    st.stop()
+
 st.markdown("<h1 style='margin-bottom:6px;'>🎵 YouTube 點唱機（單欄）</h1>", unsafe_allow_html=True)
 
 # 控制 expander 展開/收起
@@ -20,6 +31,13 @@ with st.expander("輸入 YouTube 影片或播放清單網址（每行一個）",
     uploaded_cookies = st.file_uploader("（選擇性）上傳 cookies.txt", type=["txt"])
     parse_btn = st.button("開始解析並產生清單")
 
+# 僅音訊模式：改播最低畫質或純音訊的 HLS，背景聽歌時省下大部分流量與解碼耗電
+audio_mode = st.toggle("🎧 僅音訊模式（省流量）", key="audio_mode")
+estimate_box = st.empty()
+
+# 固定位置的狀態訊息，避免訊息出現/消失時播放器被重新掛載
+status_box = st.empty()
+
 
 def fetch_info(url, cookiefile=None, timeout=30, extract_flat=False):
     opts = {"skip_download": True, "quiet": True, "no_warnings": True, "socket_timeout": timeout}
@@ -34,12 +52,38 @@ def choose_best_m3u8(formats):
     candidates.sort(key=lambda f: (int(f.get("height") or 0), float(f.get("tbr") or 0)), reverse=True)
     return candidates[0]
 
+def choose_audio_m3u8(formats):
+    """僅音訊模式用：優先純音訊的 HLS，沒有的話退回最低畫質的 HLS。"""
+    candidates = [f for f in formats if f.get("url") and ("m3u8" in (f.get("protocol") or "").lower() or "hls" in (f.get("format_note") or "").lower())]
+    if not candidates: return None
+    audio = [f for f in candidates if (f.get("vcodec") or "").lower() == "none"]
+    if audio:
+        return max(audio, key=lambda f: float(f.get("abr") or f.get("tbr") or 0))
+    return min(candidates, key=lambda f: (int(f.get("height") or 0), float(f.get("tbr") or 0)))
+
+def probe_track(video_url, audio=False):
+    """背景重試用：不帶 cookies 重新擷取，回傳 m3u8 網址（audio 為 True 時為僅音訊用的）或 None。"""
+    best = (choose_audio_m3u8 if audio else choose_best_m3u8)(fetch_info(video_url).get("formats") or [])
+    return best.get("url") if best else None
+
 def fetch_best_m3u8_for_video(video_url, cookiefile=None, timeout=25):
+    # 斷路器打開（近期失敗、背景重試中）的影片不擷取，直接回傳原因
+    blocked = BREAKER.blocked(video_url, with_cookies=bool(cookiefile))
+    if blocked:
+        return {"title": video_url, "url": None, "error": blocked}
     try:
         info = fetch_info(video_url, cookiefile=cookiefile, timeout=timeout, extract_flat=False)
-        best = choose_best_m3u8(info.get("formats") or [])
-        return {"title": info.get("title") or video_url, "url": best.get("url") if best else None, "webpage_url": info.get("webpage_url")}
+        formats = info.get("formats") or []
+        best, low = choose_best_m3u8(formats), choose_audio_m3u8(formats)
+        if best: BREAKER.record_success(video_url)
+        else: BREAKER.record_failure(video_url, "找不到 m3u8/HLS 格式", probe=partial(probe_track, video_url), probe_after=2)
+        return {"title": info.get("title") or video_url, "url": best.get("url") if best else None, "webpage_url": info.get("webpage_url") or video_url,
+                "tbr": best.get("tbr") if best else None, "audio_url": low.get("url") if low else None,
+                "audio_tbr": (low.get("tbr") or low.get("abr")) if low else None,
+                "audio_only": bool(low) and (low.get("vcodec") or "").lower() == "none"}
     except Exception as e:
+        # 使用者貼上的清單可能含已刪除或私人影片：同一首至少被要求兩次才交給背景重試
+        BREAKER.record_failure(video_url, e, probe=partial(probe_track, video_url), probe_after=2)
         return {"title": video_url, "url": None, "error": str(e)}
 
 def fetch_playlist_entries_flat(playlist_url, cookiefile=None):
@@ -78,8 +122,36 @@ if parse_btn:
                 except Exception as exc: res = {"title": item["title"], "url": None, "error": str(exc)}
                 results.append(res)
         playable = [r for r in results if r.get("url")]
+        # 帶 cookies 取得的網址只給這個 session，不放進跨 session 的快取
+        if not cookiefile_path:
+            for r in playable:
+                remember(r["webpage_url"], r["url"])
+                remember(r["webpage_url"] + "#audio", r.get("audio_url"))
         st.session_state["playable"], st.session_state["selected_index"] = playable, 0 if playable else None
-        st.success(f"解析完成：可播放 {len(playable)} 項")
+        status_box.success(f"解析完成：可播放 {len(playable)} 項")
+
+def refresh_track(track_id, stale_url):
+    """串流網址過期時只重新解析該首，優先使用其他 session 剛解析好的網址。"""
+    field = "audio_url" if audio_mode else "url"
+    choose = choose_audio_m3u8 if audio_mode else choose_best_m3u8
+    def resolve():
+        # 直接擷取並讓錯誤丟出，由 refresh_stream 以實際的錯誤記錄一次失敗
+        cookiefile_path = None
+        if uploaded_cookies:
+            tmp = tempfile.NamedTemporaryFile(delete=False)
+            tmp.write(uploaded_cookies.getbuffer()); tmp.close()
+            cookiefile_path = tmp.name
+        try:
+            best = choose(fetch_info(track_id, cookiefile=cookiefile_path, timeout=25).get("formats") or [])
+            return best.get("url") if best else None
+        finally:
+            if cookiefile_path and os.path.exists(cookiefile_path): os.remove(cookiefile_path)
+    new_url = refresh_stream(track_id + ("#audio" if audio_mode else ""), stale_url, resolve,
+                             probe=partial(probe_track, track_id, audio_mode), with_cookies=bool(uploaded_cookies))
+    if new_url:
+        for p in st.session_state.get("playable", []):
+            if p.get("webpage_url") == track_id: p[field] = new_url
+    return new_url
 
 def youtube_id_from_url(url):
     m = re.search(r"(?:v=|\\/)([0-9A-Za-z_-]{11})(?:[&?#]|$)", url or "")
@@ -91,221 +163,26 @@ safe_playable = []
 for p in playable:
     vid = youtube_id_from_url(p.get("webpage_url") or p.get("url"))
     thumb = f"https://i.ytimg.com/vi/{vid}/hqdefault.jpg" if vid else "https://placehold.co/640x360/0b1b2b/ffffff?text=No+Cover"
-    safe_playable.append({"title": escape(p.get("title","")), "url": p.get("url"), "thumb": thumb})
-js_list = json.dumps(safe_playable)
+    url = (p.get("audio_url") or p.get("url")) if audio_mode else p.get("url")
+    safe_playable.append({"id": p.get("webpage_url") or p.get("url"), "title": escape(p.get("title","")), "url": url, "thumb": thumb})
 init_selected = selected_index if selected_index is not None else 0
-# app.py (Part 2A: HTML + CSS)
-html_template = '''
-<!doctype html>
-<html>
-<head>
-<meta charset="utf-8">
-<meta name="viewport" content="width=device-width,initial-scale=1">
-<style>
-body {margin:0;font-family:sans-serif;color:#e6eef8;background:#071021;}
-.container {max-width:900px;margin:12px auto;padding:12px;}
-.video-inline {width:100%;max-width:720px;margin-top:8px;border-radius:6px;background:black;}
-.list-area {margin-top:12px;max-height:300px;overflow:auto;}
-.song-item {display:flex;gap:8px;align-items:center;padding:8px;border-radius:6px;margin-bottom:6px;background:rgba(255,255,255,0.05);}
-.song-thumb {width:60px;height:34px;object-fit:cover;border-radius:4px;}
-.song-meta {flex:1;}
-.small-btn {padding:4px 6px;border-radius:4px;background:transparent;border:1px solid rgba(255,255,255,0.2);color:#cfe8ff;cursor:pointer;}
-.selected {background:#1f6feb;color:#fff;}
-.btn-row {display:flex;gap:8px;margin-top:8px;justify-content:center;}
-.btn {padding:6px 10px;border-radius:6px;background:#1f6feb;color:#fff;border:none;cursor:pointer;}
-.red-dot {color:red;font-weight:bold;margin-left:4px;}
-</style>
-</head>
-<body>
-<div class="container">
-  <div id="playerPanel">
-    <div id="selectedTitle" style="font-weight:600;">尚未選擇項目</div>
-    <video id="video" controls playsinline class="video-inline"></video>
-    <div class="btn-row">
-      <button id="prevBtn" class="btn">⏮ 上一項</button>
-      <button id="nextBtn" class="btn">⏭ 下一項</button>
-      <button id="loopBtn" class="btn">🔁 循環</button>
-      <button id="shuffleBtn" class="btn">🔀 隨機</button>
-    </div>
-  </div>
-  <div style="margin-top:12px;font-weight:600;color:#cfe8ff;">候選清單</div>
-  <div id="listArea" class="list-area"></div>
-  <div style="margin-top:12px;font-weight:600;color:#cfe8ff;">播放佇列</div>
-  <div class="btn-row">
-    <button id="addAllBtn" class="btn">➕ 全部加入佇列</button>
-  </div>
-  <div id="queueArea" class="list-area"></div>
-</div>
-<script src="https://cdn.jsdelivr.net/npm/hls.js@1.4.0/dist/hls.min.js"></script>
-<script>
-const list={JS_LIST};let selectedIndex={INIT_SELECTED};let queue=[];
-let loopMode=false, shuffleMode=false;
-
-const listArea=document.getElementById('listArea'),queueArea=document.getElementById('queueArea'),
-selectedTitle=document.getElementById('selectedTitle'),video=document.getElementById('video');
-
-function renderList(){
-  listArea.innerHTML='';
-  if(!list||list.length===0){listArea.innerHTML='<div>候選清單為空</div>';return;}
-  list.forEach((item,i)=>{
-    const inQueue = queue.find(q=>q.url===item.url);
-    const div=document.createElement('div');
-    div.className='song-item'+(i===selectedIndex?' selected':'');
-    div.innerHTML=`<img class="song-thumb" src="${item.thumb}">
-                   <div class="song-meta">${i+1}. ${item.title}${inQueue?'<span class="red-dot">●</span>':''}</div>
-                   <button class="small-btn select-btn" data-i="${i}">選擇</button>`;
-    listArea.appendChild(div);
-  });
-  attachSelectHandlers();
-}
-
-function renderQueue(){
-  queueArea.innerHTML='';
-  if(queue.length===0){queueArea.innerHTML='<div>佇列為空</div>';return;}
-  queue.forEach((item,i)=>{
-    const div=document.createElement('div');
-    div.className='song-item';
-    div.innerHTML=`<img class="song-thumb" src="${item.thumb}"><div class="song-meta">Q${i+1}. ${item.title}</div>`;
-    queueArea.appendChild(div);
-  });
-}
-
-function attachSelectHandlers(){
-  document.querySelectorAll('.select-btn').forEach(btn=>{
-    btn.onclick=(e)=>{
-      const i=parseInt(e.target.dataset.i);
-      selectedIndex=i;
-      document.querySelectorAll('.action-row').forEach(el=>el.remove());
-      const action=document.createElement('div');
-      action.className='action-row btn-row';
-      action.innerHTML=`<button class="btn" onclick="playItem(${i})">▶ 播放</button>
-                        <button class="btn" onclick="toggleQueue(${i})">佇列</button>
-                        <button class="btn" onclick="removeItem(${i})">刪除</button>`;
-      e.target.parentNode.appendChild(action);
-      document.body.onclick=(ev)=>{
-        if(!action.contains(ev.target) && ev.target!==btn){action.remove();}
-      };
-    };
-  });
-}
-
-function updateSelectedUI(autoplay=true){
-  if(!list||list.length===0)return;
-  const cur=list[selectedIndex];
-  selectedTitle.innerText=`選擇：${selectedIndex+1}. ${cur.title}`;
-  loadHls(cur.url,autoplay);
-}
-
-function loadHls(url,autoplay=false){
-  if(!url)return;
-  video.muted=false;
-  if(video.canPlayType('application/vnd.apple.mpegurl')){
-    video.src=url;if(autoplay)video.play().catch(()=>{});
-  }else if(Hls.isSupported()){
-    if(window._hls_instance){try{window._hls_instance.destroy();}catch(e){}window._hls_instance=null;}
-    const hls=new Hls();window._hls_instance=hls;
-    hls.loadSource(url);hls.attachMedia(video);
-    hls.on(Hls.Events.MANIFEST_PARSED,function(){if(autoplay)video.play().catch(()=>{});});
-  }else{video.src=url;if(autoplay)video.play().catch(()=>{});}
-}
-
-function playItem(i){selectedIndex=i;updateSelectedUI(true);}
-
-// 單項加入佇列
-function toggleQueue(i){
-  const item=list[i];
-  const idx=queue.findIndex(q=>q.url===item.url);
-  if(idx>=0){
-    queue.splice(idx,1);
-  }else{
-    queue.push(item);
-    if(queue.length===1){
-      selectedIndex=i;
-      updateSelectedUI(true);
-    }
-  }
-  renderList();renderQueue();
-}
-
-// 一鍵全部加入佇列後立刻播放第一首
-document.getElementById('addAllBtn').onclick=()=>{
-  list.forEach(item=>{
-    if(!queue.find(q=>q.url===item.url)){
-      queue.push(item);
-    }
-  });
-  if(queue.length>0){
-    selectedIndex=list.findIndex(x=>x.url===queue[0].url);
-    updateSelectedUI(true);
-  }
-  renderList();
-  renderQueue();
-};
-
-function removeItem(i){
-  list.splice(i,1);
-  if(selectedIndex>=list.length)selectedIndex=Math.max(0,list.length-1);
-  renderList();renderQueue();
-}
-
-// 控制播放佇列的上一項/下一項
-document.getElementById('prevBtn').onclick=()=>{
-  if(queue.length>0){
-    const idx=queue.findIndex(q=>q.url===list[selectedIndex].url)-1;
-    if(idx>=0){const prev=queue[idx];selectedIndex=list.findIndex(x=>x.url===prev.url);updateSelectedUI(true);}
-  }
-};
-document.getElementById('nextBtn').onclick=()=>{
-  if(queue.length>0){
-    const idx=queue.findIndex(q=>q.url===list[selectedIndex].url)+1;
-    if(idx<queue.length){const next=queue[idx];selectedIndex=list.findIndex(x=>x.url===next.url);updateSelectedUI(true);}
-  }
-};
-
-// 循環 / 隨機播放模式切換
-document.getElementById('loopBtn').onclick=()=>{
-  loopMode=!loopMode;
-  alert("循環播放: "+(loopMode?"開啟":"關閉"));
-};
-document.getElementById('shuffleBtn').onclick=()=>{
-  shuffleMode=!shuffleMode;
-  alert("隨機播放: "+(shuffleMode?"開啟":"關閉"));
-};
-
-video.addEventListener('ended',()=>{
-  if(queue.length>0){
-    const idx=queue.findIndex(q=>q.url===list[selectedIndex].url)+1;
-    if(idx<queue.length){
-      const next=queue[idx];
-      selectedIndex=list.findIndex(x=>x.url===next.url);
-      renderList();
-      loadHls(list[selectedIndex].url,true);
-    }else if(loopMode){
-      const next=queue[0];
-      selectedIndex=list.findIndex(x=>x.url===next.url);
-      renderList();
-      loadHls(list[selectedIndex].url,true);
-    }
-    renderQueue();
-    return;
-  }
-  if(shuffleMode && list.length>0){
-    selectedIndex=Math.floor(Math.random()*list.length);
-    renderList();
-    loadHls(list[selectedIndex].url,true);
-    return;
-  }
-});
-
-renderList();
-renderQueue();
-</script>
-</body>
-</html>
-'''
-
-
-
-html_template = html_template.replace("{JS_LIST}", js_list).replace("{INIT_SELECTED}", str(init_selected))
-st.components.v1.html(html_template, height=900, scrolling=True)
 
+# 依各曲選到的格式位元率估算每小時流量（實際值見 ?qoe=1 的 bytes_per_hour_mb）
+def mb_per_hour(kbps_list):
+    kbps = [float(k) for k in kbps_list if k]
+    return sum(kbps) / len(kbps) * 1000 / 8 * 3600 / 1e6 if kbps else None
+
+video_mb = mb_per_hour(p.get("tbr") for p in playable)
+audio_mb = mb_per_hour(p.get("audio_tbr") for p in playable)
+if video_mb and audio_mb:
+    pure = sum(1 for p in playable if p.get("audio_only"))
+    estimate_box.caption(f"預估每小時流量：影片 {video_mb:.0f} MB／僅音訊 {audio_mb:.0f} MB"
+                         f"（{pure}/{len(playable)} 首有純音訊格式，其餘使用最低畫質）")
+
+# 播放器只掛載一次；rerun 只送出清單的增量變化，前端回報目前選擇與佇列
+player_state = jukebox_player(safe_playable, selected_index=init_selected, height=900, audio_only=audio_mode,
+                              on_refresh=refresh_track,
+                              on_beacon=lambda b: COLLECTOR.ingest("app3.py", b))
+if player_state.get("index") is not None and playable:
+    st.session_state["selected_index"] = player_state["index"]
+    st.session_state["queue"] = player_state.get("queue") or []
@@ -0,0 +1 @@
+# loadtest: 以假擷取器對 app 做同時多 session 壓力測試（見 run.py）
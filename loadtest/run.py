@@ -0,0 +1,252 @@
+# run: 同時多個 session 的壓力測試
+#
+# 以 streamlit.testing 的 AppTest 在同一個 process 內同時開多個 session 執行 app，
+# yt_dlp 換成 loadtest/yt_dlp_stub.py（可設定延遲與失敗率）。每個 session：
+#   1. 首次載入直到頁面可播放（app3.py 另外模擬輸入網址並按下解析）
+#   2. 再 rerun 一次（相當於使用者碰了其他元件）
+# 依同時連線數回報：頁面就緒延遲百分位、rerun 延遲、每 session 擷取次數、
+# 播放器元件參數大小、CPU 與 RSS。瀏覽器端的播放與渲染不在量測範圍內。
+# 注意 CPU 與 RSS 是整個 process 的數字，包含同一個 process 內的 AppTest 用戶端與
+# 壓力測試本身的執行緒，並非伺服器單獨的負載。
+# 每個同時連線數開始前都會清空串流快取與斷路器，各級數字因此可以互相比較。
+#
+# 用法：python -m loadtest.run --app app.py --concurrency 1,10,50 --latency 0.2 --failure-rate 0.05
+import argparse
+import concurrent.futures
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+from loadtest import yt_dlp_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTED_STREAMLIT = "1.66.0"   # prepare_app_test 修改的內部介面在這個版本驗證過
+PLAYLIST_URL = "https://youtube.com/playlist?list=PLstub"
+
+
+def install_stub():
+    """讓 app 的 `from yt_dlp import YoutubeDL` 拿到假擷取器。"""
+    sys.modules["yt_dlp"] = yt_dlp_stub
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def prepare_app_test():
+    """讓 AppTest 可以在多個執行緒同時跑。
+
+    - AppTest 每次執行結束都會把 Runtime._instance 設回 None，其他仍在執行的 session
+      會因此找不到 Runtime；這裡讓 instance() 在空檔時沿用最後一個。
+    - 多個執行緒同時編譯腳本時 ast.parse 偶爾會失敗，編譯改成一次一個。
+
+    兩者都是 Streamlit 的內部介面，版本不同時可能已經改名；找不到就直接停止，
+    避免在沒有修補的情況下跑出不可信的數字。
+    """
+    import streamlit
+    from streamlit.runtime import Runtime
+
+    try:
+        from streamlit.runtime.scriptrunner import script_cache
+        add_magic = script_cache.magic.add_magic
+        original = Runtime.instance.__func__
+        Runtime._instance
+    except (ImportError, AttributeError) as e:
+        raise SystemExit(f"streamlit {streamlit.__version__} 的內部介面與壓力測試不相容"
+                         f"（已驗證版本 {TESTED_STREAMLIT}）：{e}")
+    if streamlit.__version__ != TESTED_STREAMLIT:
+        print(f"注意：streamlit {streamlit.__version__} 未經驗證（已驗證版本 {TESTED_STREAMLIT}）", file=sys.stderr)
+
+    last = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            last["runtime"] = cls._instance
+            return cls._instance
+        if "runtime" in last:
+            return last["runtime"]
+        return original(cls)
+
+    def exists(cls):
+        return cls._instance is not None or "runtime" in last
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+    compile_lock = threading.Lock()
+
+    def locked_add_magic(code, script_path):
+        with compile_lock:
+            return add_magic(code, script_path)
+
+    script_cache.magic.add_magic = locked_add_magic
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # 非 Linux：只能拿到峰值（macOS 單位為 bytes，其他為 KB）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(q / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def component_protos(at):
+    """目前畫面上所有自訂元件的 proto。"""
+    stack = list(at._tree.children.values())
+    while stack:
+        node = stack.pop()
+        proto = getattr(node, "proto", None)
+        if proto is not None and hasattr(proto, "json_args"):
+            yield proto
+        stack.extend(getattr(node, "children", {}).values())
+
+
+def component_payload(at):
+    """目前畫面上所有自訂元件的參數 JSON 大小（bytes）。"""
+    return sum(len(proto.json_args.encode("utf-8")) for proto in component_protos(at))
+
+
+def acknowledge_player(at):
+    """照前端 applyOps 的做法回報：只依實際送到元件的 ops 推進 applied，缺口或沒有 set 時要求重送。"""
+    for proto in component_protos(at):
+        args = json.loads(proto.json_args)
+        key, ops = args.get("key"), args.get("ops")
+        if ops is None or not key:
+            continue
+        reported = at.session_state[key] if key in at.session_state else {}
+        applied = (reported or {}).get("applied") or 0
+        value = {}
+        if applied == 0 and not any(op["op"] == "set" for op in ops):
+            value["resync"] = f"loadtest-{applied}"
+        for op in ops:
+            if "resync" in value:
+                break
+            if op["seq"] <= applied:
+                continue
+            if op["op"] != "set" and op["seq"] != applied + 1:
+                value["resync"] = f"loadtest-{op['seq']}"
+                break
+            applied = op["seq"]
+        value["applied"] = applied
+        at.session_state[key] = value
+
+
+def run_session(app, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, app), default_timeout=timeout)
+    t0 = time.perf_counter()
+    at.run()
+    if app == "app3.py":
+        at.text_area[0].input(PLAYLIST_URL)
+        at.button[0].click()
+        at.run()
+    ready = time.perf_counter() - t0
+    first_payload = component_payload(at)
+    error = str(at.exception[0].message) if at.exception else None
+
+    # 模擬前端套用操作後的回報，rerun 時只應送出空的增量
+    acknowledge_player(at)
+    t1 = time.perf_counter()
+    at.run()
+    rerun = time.perf_counter() - t1
+    return {
+        "ready": ready,
+        "rerun": rerun,
+        "payload_first": first_payload,
+        "payload_rerun": component_payload(at),
+        "error": error or (str(at.exception[0].message) if at.exception else None),
+    }
+
+
+def reset_state():
+    """每個同時連線數從相同的初始狀態開始：清空串流快取、斷路器與背景重試，擷取計數歸零。"""
+    import resolver
+
+    resolver.BREAKER.reset()
+    resolver.STREAM_CACHE.clear()
+    yt_dlp_stub.reset()
+
+
+def run_level(app, concurrency, timeout):
+    reset_state()
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as ex:
+        sessions = list(ex.map(lambda _: run_session(app, timeout), range(concurrency)))
+    wall = time.perf_counter() - wall0
+    calls = yt_dlp_stub.call_count()
+    ok = [s for s in sessions if not s["error"]]
+    return {
+        "concurrency": concurrency,
+        "sessions_ok": len(ok),
+        "sessions_error": len(sessions) - len(ok),
+        "ready_p50": percentile([s["ready"] for s in ok], 50),
+        "ready_p90": percentile([s["ready"] for s in ok], 90),
+        "ready_p99": percentile([s["ready"] for s in ok], 99),
+        "rerun_p50": percentile([s["rerun"] for s in ok], 50),
+        "extractions_per_session": calls / float(concurrency),
+        "payload_first_bytes": percentile([s["payload_first"] for s in ok], 50),
+        "payload_rerun_bytes": percentile([s["payload_rerun"] for s in ok], 50),
+        "cpu_percent": 100.0 * (time.process_time() - cpu0) / wall if wall else 0.0,
+        "rss_mb": rss_bytes() / (1024.0 * 1024.0),
+        "errors": sorted({s["error"] for s in sessions if s["error"]}),
+    }
+
+
+def format_row(r):
+    def sec(v):
+        return "-" if v is None else f"{v:.2f}"
+    return (f"{r['concurrency']:>5} {r['sessions_ok']:>4}/{r['sessions_error']:<4} "
+            f"{sec(r['ready_p50']):>7} {sec(r['ready_p90']):>7} {sec(r['ready_p99']):>7} {sec(r['rerun_p50']):>7} "
+            f"{r['extractions_per_session']:>8.1f} {r['payload_first_bytes'] or 0:>8} {r['payload_rerun_bytes'] or 0:>8} "
+            f"{r['cpu_percent']:>6.0f} {r['rss_mb']:>8.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以假擷取器對 app 做同時多 session 壓力測試")
+    parser.add_argument("--app", default="app.py", choices=["app.py", "app2.py", "app3.py"])
+    parser.add_argument("--concurrency", default="1,10,50", help="逗號分隔的同時 session 數，例如 1,10,50,500")
+    parser.add_argument("--latency", type=float, default=0.2, help="每次擷取的延遲秒數")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="擷取失敗機率（0~1）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--playlist-size", type=int, default=20, help="app3.py 播放清單的項目數")
+    parser.add_argument("--no-audio-hls", action="store_true", help="假擷取器不提供純音訊 HLS 格式")
+    parser.add_argument("--timeout", type=float, default=300, help="單一 session 一次執行的逾時秒數")
+    parser.add_argument("--json", dest="json_path", help="另外把結果寫成 JSON 檔")
+    args = parser.parse_args(argv)
+
+    install_stub()
+    prepare_app_test()
+    yt_dlp_stub.configure(latency=args.latency, failure_rate=args.failure_rate,
+                          seed=args.seed, playlist_size=args.playlist_size, audio_hls=not args.no_audio_hls)
+
+    print(f"app={args.app} latency={args.latency}s failure_rate={args.failure_rate}")
+    print(f"{'conc':>5} {'ok/err':<9} {'p50':>7} {'p90':>7} {'p99':>7} {'rerun':>7} "
+          f"{'extr/ses':>8} {'payload':>8} {'rerun_pl':>8} {'cpu%':>6} {'rss_mb':>8}")
+    results = []
+    for level in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+        r = run_level(args.app, level, args.timeout)
+        results.append(r)
+        print(format_row(r), flush=True)
+        for err in r["errors"]:
+            print(f"      error: {err}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"app": args.app, "latency": args.latency, "failure_rate": args.failure_rate,
+                       "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# yt_dlp_stub: 取代 yt_dlp 的本地假擷取器（壓力測試用）
+#
+# 只實作 app 會用到的 YoutubeDL(opts).extract_info(url, download=False)。
+# 每次擷取固定睡 latency 秒；是否失敗由 (seed, url, 第幾次擷取) 的雜湊決定，
+# 因此同樣的設定每次跑出來的失敗分布都相同。
+import threading
+import time
+import zlib
+
+_config = {"latency": 0.2, "failure_rate": 0.0, "seed": 0, "playlist_size": 20, "audio_hls": True}
+_lock = threading.Lock()
+_attempts = {}
+_calls = 0
+
+
+class DownloadError(Exception):
+    pass
+
+
+def configure(latency=None, failure_rate=None, seed=None, playlist_size=None, audio_hls=None):
+    for name, value in (("latency", latency), ("failure_rate", failure_rate),
+                        ("seed", seed), ("playlist_size", playlist_size), ("audio_hls", audio_hls)):
+        if value is not None:
+            _config[name] = value
+
+
+def reset():
+    global _calls
+    with _lock:
+        _attempts.clear()
+        _calls = 0
+
+
+def call_count():
+    return _calls
+
+
+def _should_fail(url, attempt):
+    h = zlib.crc32(f"{_config['seed']}:{url}:{attempt}".encode("utf-8"))
+    return h / 0xFFFFFFFF < _config["failure_rate"]
+
+
+def _video_id(url):
+    return format(zlib.crc32(url.encode("utf-8")), "011x")[-11:]
+
+
+def _formats(vid):
+    expire = int(time.time()) + 6 * 3600
+    formats = []
+    for height, tbr in ((144, 290), (360, 700), (720, 2500), (1080, 4500)):
+        formats.append({
+            "format_id": str(height),
+            "protocol": "m3u8_native",
+            "ext": "mp4",
+            "height": height,
+            "tbr": float(tbr),
+            "vcodec": "avc1.4d401e",
+            "acodec": "mp4a.40.2",
+            "url": f"https://stub.invalid/{vid}/expire/{expire}/{height}.m3u8",
+        })
+    if _config["audio_hls"]:
+        formats.append({
+            "format_id": "234",
+            "protocol": "m3u8_native",
+            "ext": "mp4",
+            "tbr": 130.0,
+            "abr": 130.0,
+            "vcodec": "none",
+            "acodec": "mp4a.40.2",
+            "url": f"https://stub.invalid/{vid}/expire/{expire}/audio.m3u8",
+        })
+    return formats
+
+
+class YoutubeDL:
+    def __init__(self, opts=None):
+        self.opts = opts or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=False):
+        global _calls
+        with _lock:
+            _calls += 1
+            attempt = _attempts.get(url, 0)
+            _attempts[url] = attempt + 1
+        time.sleep(_config["latency"])
+        if _should_fail(url, attempt):
+            raise DownloadError(f"stub: extraction failed for {url}")
+
+        vid = _video_id(url)
+        if self.opts.get("extract_flat"):
+            entries = [{"title": f"Stub track {i + 1}",
+                        "url": f"https://www.youtube.com/watch?v={_video_id(url + str(i))}"}
+                       for i in range(_config["playlist_size"])]
+            return {"title": "Stub playlist", "entries": entries, "webpage_url": url}
+        return {"title": f"Stub video {vid}", "formats": _formats(vid), "webpage_url": url}
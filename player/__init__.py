@@ -0,0 +1,131 @@
+# player: 只掛載一次的雙向 HLS 播放器元件
+#
+# st.components.v1.html 每次 rerun 都會產生新的 iframe，影片因此重新緩衝、
+# 點唱機佇列也會遺失。這裡改用 declare_component 並固定 key：iframe 只掛載一次，
+# 之後每次 rerun 只送出「尚未被前端確認」的增量操作（set / append / update），
+# 前端則回報目前播放項目、佇列等狀態。
+#
+# 簽章網址過期時，前端會回報 {"refresh": {"id", "url", "nonce"}}；下一次 rerun
+# 由 on_refresh 只重新解析該項目，新網址以 update 操作送回，前端原地續播；
+# id 不在目前清單中的請求直接忽略。
+#
+# 前端也會把播放品質統計（首播、卡頓、切換、錯誤）打包成 beacon 隨回報送出，
+# 由 on_beacon 交給 telemetry 彙總；同一個 beacon 只處理一次。處理過的 bid 會以
+# beacon_ack 送回，前端收到確認前會一直重送同一個 beacon（Streamlit 會合併連續的
+# 元件回報，沒有確認的話前一個 beacon 可能被覆蓋而遺失）。不在目前清單中的項目不列入統計。
+import os
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+_FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend")
+
+_tv_component = components.declare_component("tv_player", path=os.path.join(_FRONTEND_DIR, "tv"))
+_jukebox_component = components.declare_component("jukebox_player", path=os.path.join(_FRONTEND_DIR, "jukebox"))
+
+
+def _sync_state(key):
+    state_key = key + "__sync"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = {"seq": 0, "ops": [], "sent": None, "resync": None,
+                                       "refresh": None, "refreshed": None, "beacon": None}
+    return st.session_state[state_key]
+
+
+def diff_items(sent, items):
+    """比較上次送出的清單與目前清單，回傳需要送給前端的增量操作。"""
+    if sent is None:
+        return [{"op": "set", "items": items}]
+    sent_ids = [it["id"] for it in sent]
+    ids = [it["id"] for it in items]
+    if ids[:len(sent_ids)] != sent_ids:
+        # 刪除或重新排序：直接整份替換
+        return [{"op": "set", "items": items}]
+    previous = {it["id"]: it for it in sent}
+    ops = [{"op": "update", "item": it} for it in items[:len(sent)] if it != previous[it["id"]]]
+    if len(items) > len(sent):
+        ops.append({"op": "append", "items": items[len(sent):]})
+    return ops
+
+
+def _handle_refresh(key, items, on_refresh):
+    """處理前端的單一項目重新解析請求；同一個 nonce 只處理一次。"""
+    sync = _sync_state(key)
+    request = (st.session_state.get(key) or {}).get("refresh")
+    if not request or request.get("nonce") == sync["refresh"]:
+        return items, sync["refreshed"]
+    sync["refresh"] = request["nonce"]
+    # id 來自前端，只接受目前清單中的項目，避免對任意網址擷取
+    known = any(it["id"] == request.get("id") for it in items)
+    new_url = on_refresh(request["id"], request.get("url")) if on_refresh and known else None
+    sync["refreshed"] = {"nonce": request["nonce"], "ok": bool(new_url)}
+    if new_url:
+        items = [dict(it, url=new_url) if it["id"] == request["id"] else it for it in items]
+    return items, sync["refreshed"]
+
+
+def _handle_beacon(key, items, on_beacon):
+    """處理前端送來的 beacon，回傳最後處理過的 bid 供前端確認。"""
+    sync = _sync_state(key)
+    beacon = (st.session_state.get(key) or {}).get("beacon")
+    if not isinstance(beacon, dict) or beacon.get("bid") == sync["beacon"]:
+        return sync["beacon"]
+    sync["beacon"] = beacon.get("bid")
+    if on_beacon and isinstance(beacon.get("items"), dict):
+        ids = {it["id"] for it in items}
+        on_beacon(dict(beacon, items={k: v for k, v in beacon["items"].items() if k in ids}))
+    return sync["beacon"]
+
+
+def _pending_ops(key, items):
+    sync = _sync_state(key)
+    reported = st.session_state.get(key) or {}
+
+    # 前端已套用的操作不必再送
+    applied = reported.get("applied") or 0
+    sync["ops"] = [op for op in sync["ops"] if op["seq"] > applied]
+
+    # 前端缺少中間的操作（例如 iframe 被重新掛載），整份重送
+    token = reported.get("resync")
+    if token and token != sync["resync"]:
+        sync["resync"] = token
+        sync["sent"] = None
+        sync["ops"] = []
+
+    for op in diff_items(sync["sent"], items):
+        sync["seq"] += 1
+        op["seq"] = sync["seq"]
+        sync["ops"].append(op)
+    sync["sent"] = [dict(it) for it in items]
+    return sync["ops"]
+
+
+def tv_player(channels, layout="names", height=700, on_refresh=None, on_beacon=None, key="tv_player"):
+    """顯示直播頻道播放器，回傳前端回報的狀態（目前頻道 index / id）。
+
+    channels 為 {"id", "name", "url"} 字典的清單，可另帶 "height"；
+    layout 為 "names"（左右頻道名稱）或 "buttons"（上一台/下一台按鈕）。
+    on_refresh(id, stale_url) 在串流過期時被呼叫，回傳新網址或 None。
+    on_beacon(beacon) 收到前端的播放品質統計時被呼叫。
+    """
+    beacon_ack = _handle_beacon(key, channels, on_beacon)
+    channels, refreshed = _handle_refresh(key, channels, on_refresh)
+    ops = _pending_ops(key, channels)
+    return _tv_component(ops=ops, layout=layout, height=height, refreshed=refreshed, beacon_ack=beacon_ack,
+                         key=key, default={})
+
+
+def jukebox_player(tracks, selected_index=0, height=900, audio_only=False, on_refresh=None, on_beacon=None,
+                   key="jukebox_player"):
+    """顯示點唱機播放器，回傳前端回報的狀態（選擇的項目、佇列、循環/隨機）。
+
+    tracks 為 {"id", "title", "url", "thumb"} 字典的清單，title 需已跳脫 HTML。
+    audio_only 為 True 時不顯示影片畫面，只顯示封面（url 應已換成純音訊或最低畫質的串流）。
+    on_refresh(id, stale_url) 在串流過期時被呼叫，回傳新網址或 None。
+    on_beacon(beacon) 收到前端的播放品質統計時被呼叫。
+    """
+    beacon_ack = _handle_beacon(key, tracks, on_beacon)
+    tracks, refreshed = _handle_refresh(key, tracks, on_refresh)
+    ops = _pending_ops(key, tracks)
+    return _jukebox_component(ops=ops, selected_index=selected_index, height=height, audio_only=audio_only,
+                              refreshed=refreshed, beacon_ack=beacon_ack, key=key, default={})
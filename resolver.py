@@ -0,0 +1,265 @@
+# resolver: 單一串流的重新解析
+#
+# YouTube 的 m3u8 是簽章網址（路徑或參數帶 expire），過期後播放器會收到 403。
+# 這裡保存各來源最近一次不帶 cookies 解析到的網址（跨 session 共用），重新解析時：
+#   1. 若快取中已有與過期網址不同、且尚未過期的新網址，直接回傳（其他 session 剛解析過）
+#   2. 否則只對該項目做一次擷取；同一來源同時只會有一個擷取在進行
+#
+# 失敗的來源（需登入、未直播、網路問題、被限流）會依類型做負面快取並打開斷路器：
+# 斷路器打開期間頁面載入完全不擷取該來源，改由背景執行緒依類型的間隔重試，
+# 成功後關閉斷路器並把新網址放進快取。
+# 背景重試的工作量有上限：連續重試失敗 MAX_PROBE_FAILURES 次、或 PROBE_IDLE 秒內沒有人
+# 再要求這個來源，就整個移除（之後有人要求時再重新擷取）；斷路器總數超過 MAX_ENTRIES 時
+# 移除最久沒人要求的。
+import re
+import threading
+import time
+
+DEFAULT_TTL = 3600      # 網址中找不到 expire 時的保存秒數
+EXPIRE_MARGIN = 300     # 距離過期不到 5 分鐘就視為不新鮮
+
+# 失敗類型：重試間隔（秒）、連續失敗幾次才打開斷路器、顯示名稱
+FAILURE_POLICY = {
+    "auth_required": {"retry": 6 * 3600, "threshold": 1, "label": "需要登入驗證"},
+    "not_live":      {"retry": 10 * 60,  "threshold": 1, "label": "目前沒有直播"},
+    "throttled":     {"retry": 5 * 60,   "threshold": 1, "label": "被限流"},
+    "network":       {"retry": 60,       "threshold": 2, "label": "網路錯誤"},
+}
+MAX_RETRY = 6 * 3600    # 連續失敗時重試間隔加倍的上限
+PROBE_TICK = 5
+MAX_PROBE_FAILURES = 5  # 背景重試連續失敗幾次後放棄
+PROBE_IDLE = 24 * 3600  # 多久沒人要求就不再背景重試
+MAX_ENTRIES = 500
+
+# 依序比對，先符合的類型優先。YouTube 的機器人檢查（"Sign in to confirm you're not a bot
+# ... --cookies"）其實是限流，要排在「需要登入」之前；429 只認 HTTP 狀態，避免影片 id
+# 中剛好有 429 時被誤判。
+_FAILURE_PATTERNS = (
+    ("throttled", re.compile(r"not a bot|http error 429|too many requests|rate[- ]limit|\bthrottl")),
+    ("auth_required", re.compile(r"\bsign in\b|\blog ?in\b|\bcookies\b|members[- ]only|private video"
+                                 r"|confirm your age|age[- ]restricted")),
+    ("not_live", re.compile(r"not (?:currently )?live|is offline|will begin|premieres in|live event"
+                            r"|has ended|video unavailable|找不到 m3u8")),
+)
+
+_EXPIRE_RE = re.compile(r"(?:/expire/|[?&]expire=)(\d+)")
+
+
+def url_expiry(url: str, resolved_at: float):
+    """回傳網址的過期時間（epoch 秒）；網址沒有 expire 時以 DEFAULT_TTL 估計。"""
+    m = _EXPIRE_RE.search(url or "")
+    if m:
+        return int(m.group(1))
+    return resolved_at + DEFAULT_TTL
+
+
+class StreamCache:
+    def __init__(self):
+        self._entries = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def lock_for(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def put(self, key, url):
+        now = time.time()
+        with self._guard:
+            self._entries[key] = {"url": url, "expires": url_expiry(url, now)}
+
+    def get_fresh(self, key, stale_url=None):
+        """回傳仍新鮮且不等於 stale_url 的網址，否則 None。"""
+        with self._guard:
+            entry = self._entries.get(key)
+        if not entry or entry["url"] == stale_url:
+            return None
+        if entry["expires"] - time.time() < EXPIRE_MARGIN:
+            return None
+        return entry["url"]
+
+    def clear(self):
+        with self._guard:
+            self._entries.clear()
+            self._locks.clear()
+
+
+STREAM_CACHE = StreamCache()
+
+
+def remember(key, url):
+    """記錄初次解析的結果，讓之後的重新解析可以共用。"""
+    if url:
+        STREAM_CACHE.put(key, url)
+
+
+def classify_failure(error):
+    """把擷取錯誤分成 auth_required / not_live / throttled / network。"""
+    text = str(error).lower()
+    for klass, pattern in _FAILURE_PATTERNS:
+        if pattern.search(text):
+            return klass
+    return "network"
+
+
+class CircuitBreaker:
+    """每個來源一個斷路器：closed（正常）→ open（跳過擷取，等背景重試）→ 重試成功後 closed。"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._prober = None
+        self._stop = threading.Event()
+
+    def blocked(self, key, with_cookies=False):
+        """斷路器打開時回傳給使用者看的錯誤訊息，否則 None。
+
+        帶 cookies 時不擋「需要登入」的來源，讓使用者上傳的 cookies 有機會生效。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or not entry["open"]:
+                return None
+            if with_cookies and entry["class"] == "auth_required":
+                return None
+            entry["requests"] += 1
+            entry["last_request"] = time.time()
+        policy = FAILURE_POLICY[entry["class"]]
+        wait = max(0, int(entry["next_probe"] - time.time()))
+        return f"{policy['label']}（暫停嘗試，約 {wait // 60 + 1} 分鐘內背景重試）：{entry['error']}"
+
+    def record_success(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def record_failure(self, key, error, probe=None, probe_after=1):
+        """記錄一次失敗並回傳失敗類型；probe() 為背景重試用的擷取函式，回傳網址或丟出例外。
+
+        沒有 probe 的來源不會打開斷路器（否則沒有人能把它關上）；已打開的斷路器
+        再失敗（例如背景重試失敗）時維持打開，只更新類型與下次重試時間。
+        probe_after 為這個來源至少被要求幾次後才登記 probe，只被要求過一次的來源
+        （例如使用者貼上的播放清單中的某一首）不值得在背景一直重試。
+        """
+        return self._record_failure(key, error, probe, probe_after, probed=False)
+
+    def _record_failure(self, key, error, probe, probe_after, probed):
+        klass = classify_failure(error)
+        policy = FAILURE_POLICY[klass]
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and probed:
+                return klass   # 重試期間已被移除（成功或淘汰），不再建立
+            if entry is None:
+                entry = self._entries[key] = {"class": klass, "failures": 0, "open": False, "probe": None,
+                                              "requests": 0, "probe_failures": 0, "last_request": now}
+                self._evict()
+            elif entry["class"] != klass:
+                # 類型改變：重新計數，但保留 probe 與打開狀態
+                entry.update({"class": klass, "failures": 0})
+            if probed:
+                entry["probe_failures"] += 1
+                if entry["probe_failures"] >= MAX_PROBE_FAILURES:
+                    del self._entries[key]
+                    return klass
+            else:
+                entry["requests"] += 1
+                entry["last_request"] = now
+            entry["failures"] += 1
+            entry["error"] = str(error)[:300]
+            if probe is not None and entry["requests"] >= probe_after:
+                entry["probe"] = probe
+            opened = entry["probe"] is not None and (entry["open"] or entry["failures"] >= policy["threshold"])
+            if opened:
+                backoff = 2 ** max(0, entry["failures"] - policy["threshold"])
+                entry["open"] = True
+                entry["next_probe"] = now + min(policy["retry"] * backoff, MAX_RETRY)
+                entry["probing"] = False
+        if opened:
+            self._ensure_prober()
+        return klass
+
+    def _evict(self):
+        """斷路器超過 MAX_ENTRIES 時移除最久沒人要求的（呼叫時需持有鎖）。"""
+        while len(self._entries) > MAX_ENTRIES:
+            oldest = min(self._entries, key=lambda k: self._entries[k]["last_request"])
+            del self._entries[oldest]
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {k: v for k, v in entry.items() if k != "probe"} for key, entry in self._entries.items()}
+
+    def reset(self):
+        """清空所有斷路器並停止背景重試（等進行中的重試結束才回傳）。"""
+        with self._lock:
+            prober, self._prober = self._prober, None
+            self._stop.set()
+        if prober is not None:
+            prober.join()
+        with self._lock:
+            self._entries.clear()
+            self._stop = threading.Event()
+
+    def _ensure_prober(self):
+        with self._lock:
+            if self._prober is not None and self._prober.is_alive():
+                return
+            self._prober = threading.Thread(target=self._probe_loop, args=(self._stop,),
+                                            name="resolver-prober", daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self, stop):
+        while not stop.wait(PROBE_TICK):
+            self._probe_due(stop)
+
+    def _probe_due(self, stop=None):
+        """對所有已到重試時間的來源各執行一次 probe。"""
+        now = time.time()
+        with self._lock:
+            # 太久沒人要求的來源不再重試，直接移除
+            for key in [k for k, e in self._entries.items() if now - e["last_request"] > PROBE_IDLE]:
+                del self._entries[key]
+            due = [(key, entry["probe"]) for key, entry in self._entries.items()
+                   if entry["open"] and not entry["probing"] and entry["next_probe"] <= now]
+            for key, _ in due:
+                self._entries[key]["probing"] = True
+        for key, probe in due:
+            if stop is not None and stop.is_set():
+                break
+            try:
+                url = probe()
+                if not url:
+                    raise ValueError("找不到 m3u8/HLS 格式")
+            except Exception as e:
+                self._record_failure(key, e, None, 1, probed=True)
+                continue
+            self.record_success(key)
+            STREAM_CACHE.put(key, url)
+
+
+BREAKER = CircuitBreaker()
+
+
+def refresh_stream(key, stale_url, resolve, probe, with_cookies=False):
+    """重新解析單一來源；resolve() 回傳新的串流網址或 None（失敗時可丟出例外）。
+
+    probe() 是不帶 cookies 的同一個擷取，交給斷路器做背景重試；resolve 用了使用者
+    上傳的 cookies 時 with_cookies 要設為 True，取得的網址只給該 session，不放進共用快取。
+    """
+    with STREAM_CACHE.lock_for(key):
+        cached = STREAM_CACHE.get_fresh(key, stale_url)
+        if cached:
+            return cached
+        if BREAKER.blocked(key, with_cookies=with_cookies):
+            return None
+        try:
+            url = resolve()
+            if not url:
+                raise ValueError("找不到 m3u8/HLS 格式")
+        except Exception as e:
+            BREAKER.record_failure(key, e, probe=probe)
+            return None
+        BREAKER.record_success(key)
+        if not with_cookies:
+            STREAM_CACHE.put(key, url)
+        return url
@@ -0,0 +1,195 @@
+# telemetry: 播放端 QoE 統計的收集與彙總
+#
+# 播放器把 hls.js / <video> 事件在前端先依項目累加，定期（或隨狀態回報）送出精簡的 beacon：
+#   {"bid": "<mount>:<n>", "cc": "mobile-hlsjs",
+#    "items": {"<id>": {"n": 名稱, "st": [首播毫秒], "sw": [切換毫秒], "mf": [manifest 毫秒],
+#                       "pl": 播放毫秒, "rb": 卡頓毫秒, "sc": 卡頓次數, "ls": 畫質切換次數,
+#                       "er": 錯誤次數, "fe": 致命錯誤次數, "by": 下載位元組}}}
+# 原生 HLS（iOS Safari）量不到下載量，"by" 為 null；每小時流量只用有量到位元組的播放時間計算。
+# 點唱機在僅音訊模式時 client class 會帶 "-audio" 後綴，兩種模式的流量因此分開統計。
+# 伺服器依 (app, 項目, client class) 累加；snapshot() 回傳給儀表板用的彙總。
+# 設定環境變數 QOE_EXPORT_PATH 時，會定期把彙總寫成 JSON 檔供外部儀表板讀取。
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+
+MAX_SAMPLES = 500        # 每個分組保留的延遲樣本數
+MAX_ITEMS_PER_BEACON = 100
+MAX_SAMPLES_PER_BEACON = 50
+MAX_MS = 10 * 60 * 1000  # 單一數值上限，避免異常值灌爆統計
+MAX_BYTES = 4 * 1024 ** 3
+EXPORT_INTERVAL = 10
+
+_CLIENT_CLASS_RE = re.compile(r"(mobile|desktop)-(native|hlsjs)(-audio)?")
+_COUNTERS = ("pl", "rb", "sc", "ls", "er", "fe")
+_TOTALS = _COUNTERS + ("by", "bpl")   # bpl：有量到下載位元組的播放毫秒
+_SAMPLES = ("st", "sw", "mf")
+
+
+def _clamp(value, limit=MAX_MS):
+    """轉成 0~limit 的浮點數；非數值回傳 None。"""
+    if isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if value != value:
+        return None
+    return min(max(value, 0.0), float(limit))
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(q / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def _new_bucket():
+    bucket = {name: 0.0 for name in _TOTALS}
+    bucket.update({name: deque(maxlen=MAX_SAMPLES) for name in _SAMPLES})
+    bucket["name"] = None
+    return bucket
+
+
+class QoECollector:
+    def __init__(self, export_path=None):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._seen = deque(maxlen=10000)
+        self._seen_set = set()
+        self._export_path = export_path
+        self._last_export = 0.0
+
+    def ingest(self, source, beacon):
+        """累加一個 beacon；格式不符的欄位直接忽略，同一個 bid 只計一次。"""
+        if not isinstance(beacon, dict) or not isinstance(beacon.get("items"), dict):
+            return
+        bid = str(beacon.get("bid") or "")[:64]
+        # cc 來自用戶端：只接受播放器會送的幾種值，其他一律歸到 unknown，避免分組無限增加
+        client_class = beacon.get("cc")
+        if not isinstance(client_class, str) or not _CLIENT_CLASS_RE.fullmatch(client_class):
+            client_class = "unknown"
+        with self._lock:
+            if bid:
+                if bid in self._seen_set:
+                    return
+                if len(self._seen) == self._seen.maxlen:
+                    self._seen_set.discard(self._seen[0])
+                self._seen.append(bid)
+                self._seen_set.add(bid)
+            for item_id, stats in list(beacon["items"].items())[:MAX_ITEMS_PER_BEACON]:
+                if not isinstance(stats, dict):
+                    continue
+                key = (source, str(item_id)[:512], client_class)
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = _new_bucket()
+                if stats.get("n"):
+                    bucket["name"] = str(stats["n"])[:200]
+                for name in _COUNTERS:
+                    bucket[name] += _clamp(stats.get(name)) or 0.0
+                downloaded = _clamp(stats.get("by"), MAX_BYTES)
+                if downloaded is not None:
+                    bucket["by"] += downloaded
+                    bucket["bpl"] += _clamp(stats.get("pl")) or 0.0
+                for name in _SAMPLES:
+                    samples = stats.get(name)
+                    if isinstance(samples, list):
+                        values = (_clamp(v) for v in samples[:MAX_SAMPLES_PER_BEACON])
+                        bucket[name].extend(v for v in values if v is not None)
+        self._maybe_export()
+
+    def snapshot(self, by=("source", "item", "client_class")):
+        """依 by 指定的欄位分組回傳彙總列（延遲單位為毫秒）。"""
+        groups = {}
+        with self._lock:
+            for (source, item, client_class), bucket in self._buckets.items():
+                fields = {"source": source, "item": item, "client_class": client_class}
+                key = tuple(fields[name] for name in by)
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = {name: 0.0 for name in _TOTALS}
+                    group.update({name: [] for name in _SAMPLES})
+                    group["fields"] = {name: fields[name] for name in by}
+                    group["name"] = None
+                for name in _TOTALS:
+                    group[name] += bucket[name]
+                for name in _SAMPLES:
+                    group[name].extend(bucket[name])
+                group["name"] = group["name"] or bucket["name"]
+
+        rows = []
+        for group in groups.values():
+            plays = len(group["st"]) + len(group["sw"])
+            watched = group["pl"] + group["rb"]
+            row = dict(group["fields"])
+            if "item" in row:
+                row["name"] = group["name"]
+            row.update({
+                "plays": plays,
+                "startup_p50_ms": _percentile(group["st"], 50),
+                "startup_p90_ms": _percentile(group["st"], 90),
+                "switch_p50_ms": _percentile(group["sw"], 50),
+                "switch_p90_ms": _percentile(group["sw"], 90),
+                "manifest_p50_ms": _percentile(group["mf"], 50),
+                "play_seconds": round(group["pl"] / 1000.0, 1),
+                "rebuffer_ratio": round(group["rb"] / watched, 4) if watched else None,
+                "stalls_per_hour": round(group["sc"] * 3600000.0 / group["pl"], 2) if group["pl"] else None,
+                "bytes_per_hour_mb": round(group["by"] * 3600000.0 / group["bpl"] / 1e6, 1) if group["bpl"] else None,
+                "level_switches": int(group["ls"]),
+                "errors": int(group["er"]),
+                "fatal_errors": int(group["fe"]),
+                "error_rate": round(group["fe"] / plays, 4) if plays else None,
+            })
+            rows.append(row)
+        rows.sort(key=lambda r: -r["plays"])
+        return rows
+
+    def _maybe_export(self):
+        if not self._export_path:
+            return
+        # ingest 會在多個腳本執行緒同時呼叫：檢查與更新時間要在鎖內，同一個間隔只有一個執行緒匯出
+        now = time.time()
+        with self._lock:
+            if now - self._last_export < EXPORT_INTERVAL:
+                return
+            self._last_export = now
+        data = {
+            "generated_at": int(now),
+            "by_item": self.snapshot(),
+            "by_client_class": self.snapshot(by=("source", "client_class")),
+        }
+        # 每次寫到各自的暫存檔再換名，就算兩次匯出重疊也不會寫壞同一個檔案
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self._export_path) + ".",
+                                       dir=os.path.dirname(os.path.abspath(self._export_path)))
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.chmod(tmp, 0o644)   # mkstemp 預設只有擁有者可讀，外部儀表板可能用其他帳號讀取
+            os.replace(tmp, self._export_path)
+        except OSError:
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+
+
+COLLECTOR = QoECollector(export_path=os.environ.get("QOE_EXPORT_PATH"))
+
+
+def render_dashboard():
+    """在頁面上顯示 QoE 彙總（網址加上 ?qoe=1 時使用）。"""
+    import streamlit as st
+
+    st.subheader("播放品質（QoE）統計")
+    st.caption("依頻道／曲目與用戶端類型彙總；延遲單位為毫秒，rebuffer_ratio 為卡頓時間佔觀看時間比例。")
+    st.markdown("**依頻道／曲目**")
+    st.dataframe(COLLECTOR.snapshot())
+    st.markdown("**依用戶端類型**")
+    st.dataframe(COLLECTOR.snapshot(by=("source", "client_class")))
@@ -0,0 +1,76 @@
+import types
+
+import pytest
+
+import player
+from player import _pending_ops, diff_items
+
+KEY = "p"
+
+
+def item(i, url=None):
+    return {"id": f"id{i}", "name": f"ch{i}", "url": url or f"https://example.invalid/{i}.m3u8"}
+
+
+@pytest.fixture
+def session(monkeypatch):
+    state = {}
+    monkeypatch.setattr(player, "st", types.SimpleNamespace(session_state=state))
+    return state
+
+
+def test_diff_items():
+    a, b, c = item(1), item(2), item(3)
+    assert diff_items(None, [a]) == [{"op": "set", "items": [a]}]
+    assert diff_items([a, b], [a, b]) == []
+    assert diff_items([a], [a, b, c]) == [{"op": "append", "items": [b, c]}]
+    b2 = item(2, "https://example.invalid/new.m3u8")
+    assert diff_items([a, b], [a, b2]) == [{"op": "update", "item": b2}]
+    # 刪除或重新排序時整份替換
+    assert diff_items([a, b], [b, a]) == [{"op": "set", "items": [b, a]}]
+    assert diff_items([a, b], [a]) == [{"op": "set", "items": [a]}]
+
+
+def test_acknowledged_ops_are_not_resent(session):
+    items = [item(1), item(2)]
+    ops = _pending_ops(KEY, items)
+    assert [(op["op"], op["seq"]) for op in ops] == [("set", 1)]
+
+    # 前端尚未確認：rerun 仍然重送
+    assert [op["seq"] for op in _pending_ops(KEY, items)] == [1]
+
+    session[KEY] = {"applied": 1}
+    assert _pending_ops(KEY, items) == []
+
+    items = [item(1), item(2, "https://example.invalid/new.m3u8")]
+    ops = _pending_ops(KEY, items)
+    assert [(op["op"], op["seq"]) for op in ops] == [("update", 2)]
+
+
+def test_resync_token_resends_full_list_once(session):
+    items = [item(1), item(2)]
+    _pending_ops(KEY, items)
+    session[KEY] = {"applied": 1}
+    assert _pending_ops(KEY, items) == []
+
+    # iframe 重新掛載（或漏了中間的操作）後前端送出新的 resync token
+    session[KEY] = {"applied": 1, "resync": "t1"}
+    ops = _pending_ops(KEY, items)
+    assert [(op["op"], op["seq"]) for op in ops] == [("set", 2)]
+    assert ops[0]["items"] == items
+
+    # 同一個 token 不再觸發重送
+    session[KEY] = {"applied": 2, "resync": "t1"}
+    assert _pending_ops(KEY, items) == []
+
+
+def test_gap_keeps_unacknowledged_ops_in_order(session):
+    _pending_ops(KEY, [item(1)])
+    _pending_ops(KEY, [item(1), item(2)])
+    ops = _pending_ops(KEY, [item(1), item(2), item(3)])
+    assert [(op["op"], op["seq"]) for op in ops] == [("set", 1), ("append", 2), ("append", 3)]
+
+    # 前端只確認到 2：只剩 seq 3，前端據此判斷是否有缺口
+    session[KEY] = {"applied": 2}
+    ops = _pending_ops(KEY, [item(1), item(2), item(3)])
+    assert [(op["op"], op["seq"]) for op in ops] == [("append", 3)]
@@ -0,0 +1,170 @@
+import types
+
+import pytest
+
+import resolver
+from resolver import FAILURE_POLICY, MAX_RETRY, STREAM_CACHE, CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr(resolver, "time", types.SimpleNamespace(time=lambda: now[0]))
+    monkeypatch.setattr(CircuitBreaker, "_ensure_prober", lambda self: None)
+    STREAM_CACHE.clear()
+    yield now
+    STREAM_CACHE.clear()
+
+
+def entry(breaker, key):
+    return breaker.snapshot()[key]
+
+
+def test_network_opens_after_threshold(clock):
+    breaker = CircuitBreaker()
+    breaker.record_failure("k", "timed out", probe=lambda: None)
+    assert not entry(breaker, "k")["open"]
+    assert breaker.blocked("k") is None
+
+    breaker.record_failure("k", "timed out")
+    assert entry(breaker, "k")["open"]
+    assert entry(breaker, "k")["next_probe"] == clock[0] + FAILURE_POLICY["network"]["retry"]
+    assert breaker.blocked("k")
+
+
+def test_failure_without_probe_never_opens(clock):
+    breaker = CircuitBreaker()
+    breaker.record_failure("k", "This live event will begin in 3 hours")
+    assert entry(breaker, "k")["class"] == "not_live"
+    assert not entry(breaker, "k")["open"]
+    assert breaker.blocked("k") is None
+
+
+def test_backoff_doubles_and_is_capped(clock):
+    breaker = CircuitBreaker()
+    retry = FAILURE_POLICY["throttled"]["retry"]
+    for n in range(4):
+        breaker.record_failure("k", "HTTP Error 429: Too Many Requests", probe=lambda: None)
+        assert entry(breaker, "k")["next_probe"] == clock[0] + retry * 2 ** n
+
+    breaker.record_failure("auth", "Sign in to confirm your age", probe=lambda: None)
+    breaker.record_failure("auth", "Sign in to confirm your age")
+    assert entry(breaker, "auth")["next_probe"] == clock[0] + MAX_RETRY
+
+
+def test_probe_failing_with_other_class_keeps_breaker_open(clock):
+    breaker = CircuitBreaker()
+    errors = ["HTTP Error 429: Too Many Requests"]
+
+    def probe():
+        if errors:
+            raise RuntimeError(errors.pop())
+        return "https://example.invalid/expire/9999999999/new.m3u8"
+
+    breaker.record_failure("k", "This live event has ended", probe=probe)
+    assert entry(breaker, "k")["class"] == "not_live"
+
+    clock[0] += FAILURE_POLICY["not_live"]["retry"]
+    breaker._probe_due()
+    state = entry(breaker, "k")
+    assert state["class"] == "throttled"
+    assert state["open"] and not state["probing"]
+    assert state["next_probe"] == clock[0] + FAILURE_POLICY["throttled"]["retry"]
+    assert breaker.blocked("k").startswith(FAILURE_POLICY["throttled"]["label"])
+
+    clock[0] += FAILURE_POLICY["throttled"]["retry"]
+    breaker._probe_due()
+    assert "k" not in breaker.snapshot()
+    assert STREAM_CACHE.get_fresh("k") == "https://example.invalid/expire/9999999999/new.m3u8"
+
+
+def test_probe_failing_with_network_error_stays_open(clock):
+    breaker = CircuitBreaker()
+
+    def probe():
+        raise RuntimeError("Connection reset by peer")
+
+    breaker.record_failure("k", "HTTP Error 429", probe=probe)
+    clock[0] += FAILURE_POLICY["throttled"]["retry"]
+    breaker._probe_due()
+    state = entry(breaker, "k")
+    assert state["class"] == "network" and state["failures"] == 1
+    assert state["open"]
+    assert state["next_probe"] == clock[0] + FAILURE_POLICY["network"]["retry"]
+
+    clock[0] += FAILURE_POLICY["network"]["retry"]
+    breaker._probe_due()
+    assert entry(breaker, "k")["next_probe"] == clock[0] + FAILURE_POLICY["network"]["retry"]
+
+
+def test_probe_registered_only_after_repeated_requests(clock):
+    breaker = CircuitBreaker()
+    breaker.record_failure("k", "Private video", probe=lambda: None, probe_after=2)
+    assert not entry(breaker, "k")["open"]
+    assert breaker.blocked("k") is None
+
+    breaker.record_failure("k", "Private video", probe=lambda: None, probe_after=2)
+    assert entry(breaker, "k")["open"]
+
+
+def test_entry_dropped_after_max_probe_failures(clock):
+    breaker = CircuitBreaker()
+    calls = []
+
+    def probe():
+        calls.append(1)
+        raise RuntimeError("This live event has ended")
+
+    breaker.record_failure("k", "This live event has ended", probe=probe)
+    for n in range(resolver.MAX_PROBE_FAILURES):
+        clock[0] = entry(breaker, "k")["next_probe"]
+        breaker._probe_due()
+    assert len(calls) == resolver.MAX_PROBE_FAILURES
+    assert "k" not in breaker.snapshot()
+
+    clock[0] += MAX_RETRY
+    breaker._probe_due()
+    assert len(calls) == resolver.MAX_PROBE_FAILURES
+
+
+def test_idle_entries_are_not_probed(clock):
+    breaker = CircuitBreaker()
+    calls = []
+    breaker.record_failure("idle", "Private video", probe=lambda: calls.append("idle"))
+    breaker.record_failure("used", "Private video", probe=lambda: calls.append("used"))
+
+    clock[0] += resolver.PROBE_IDLE - 1
+    assert breaker.blocked("used")   # 有人要求就延長
+    clock[0] += 2
+    breaker._probe_due()
+    assert calls == ["used"]
+    assert "idle" not in breaker.snapshot()
+
+
+def test_entries_are_capped(clock, monkeypatch):
+    monkeypatch.setattr(resolver, "MAX_ENTRIES", 3)
+    breaker = CircuitBreaker()
+    for i in range(5):
+        clock[0] += 1
+        breaker.record_failure(f"k{i}", "timed out")
+    assert sorted(breaker.snapshot()) == ["k2", "k3", "k4"]
+
+
+@pytest.mark.parametrize("error, klass", [
+    ("ERROR: [youtube] ab429xYzQwE: Sign in to confirm your age. This video may be inappropriate for some users.",
+     "auth_required"),
+    ("ERROR: [youtube] QsGswQvRmtU: Sign in to confirm you’re not a bot. Use --cookies-from-browser or "
+     "--cookies for the authentication.", "throttled"),
+    ("ERROR: [youtube] QsGswQvRmtU: Sign in to confirm you're not a bot.", "throttled"),
+    ("ERROR: unable to download video data: HTTP Error 429: Too Many Requests", "throttled"),
+    ("ERROR: [youtube] x429x429x42: Video unavailable", "not_live"),
+    ("ERROR: [youtube] abcdefghijk: Private video. Sign in if you've been granted access to this video",
+     "auth_required"),
+    ("ERROR: [youtube] abcdefghijk: Join this channel to get access to members-only content", "auth_required"),
+    ("ERROR: [youtube] abcdefghijk: This live event will begin in 3 hours.", "not_live"),
+    ("找不到 m3u8/HLS 格式", "not_live"),
+    ("<urlopen error [Errno 110] Connection timed out>", "network"),
+    ("HTTP Error 503: Service Unavailable", "network"),
+])
+def test_classify_failure(error, klass):
+    assert resolver.classify_failure(error) == klass
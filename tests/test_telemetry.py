@@ -0,0 +1,106 @@
+import json
+
+import telemetry
+from telemetry import MAX_MS, QoECollector
+
+
+def rows(collector, **kwargs):
+    return {tuple(r[k] for k in kwargs.get("by", ("source", "item", "client_class"))): r
+            for r in collector.snapshot(**kwargs)}
+
+
+def test_malformed_beacons_are_ignored():
+    c = QoECollector()
+    for beacon in (None, "x", {}, {"items": []}, {"items": "x"}):
+        c.ingest("app.py", beacon)
+    c.ingest("app.py", {"bid": "1", "cc": "desktop-hlsjs", "items": {
+        "a": "not a dict",
+        "b": {"pl": "abc", "rb": True, "sc": float("nan"), "er": -5, "fe": 10 ** 12,
+              "st": [100, "x", None, -1, 2 * MAX_MS], "sw": "not a list"},
+    }})
+    assert list(rows(c)) == [("app.py", "b", "desktop-hlsjs")]
+    row = rows(c)[("app.py", "b", "desktop-hlsjs")]
+    assert row["play_seconds"] == 0.0
+    assert row["errors"] == 0
+    assert row["fatal_errors"] == MAX_MS
+    # 非數值丟掉，超出範圍的夾到 0~MAX_MS
+    assert row["plays"] == 3
+    assert row["startup_p50_ms"] == 100
+    assert row["startup_p90_ms"] == MAX_MS
+
+
+def test_duplicate_bid_counted_once():
+    c = QoECollector()
+    beacon = {"bid": "m:1", "cc": "mobile-hlsjs", "items": {"a": {"pl": 1000, "st": [200]}}}
+    c.ingest("app.py", beacon)
+    c.ingest("app.py", beacon)
+    c.ingest("app.py", dict(beacon, bid="m:2"))
+    row = rows(c)[("app.py", "a", "mobile-hlsjs")]
+    assert row["play_seconds"] == 2.0
+    assert row["plays"] == 2
+
+
+def test_unknown_client_class_is_grouped():
+    c = QoECollector()
+    for i, cc in enumerate(["evil-1", "evil-2", None, 7, "desktop-native-audio"]):
+        c.ingest("app3.py", {"bid": str(i), "cc": cc, "items": {"a": {"pl": 1}}})
+    assert sorted(k[2] for k in rows(c)) == ["desktop-native-audio", "unknown"]
+
+
+def test_bytes_per_hour_uses_only_measured_play_time():
+    c = QoECollector()
+    hour = 3600 * 1000
+    # 原生 HLS 量不到位元組：by 為 null
+    c.ingest("app3.py", {"bid": "1", "cc": "mobile-native-audio", "items": {"a": {"pl": 60000, "by": None}}})
+    assert rows(c)[("app3.py", "a", "mobile-native-audio")]["bytes_per_hour_mb"] is None
+
+    c.ingest("app3.py", {"bid": "2", "cc": "desktop-hlsjs", "items": {"a": {"pl": hour / 60, "by": 1e6}}})
+    c.ingest("app3.py", {"bid": "3", "cc": "desktop-hlsjs", "items": {"a": {"pl": hour / 60, "by": 1e6}}})
+    assert rows(c)[("app3.py", "a", "desktop-hlsjs")]["bytes_per_hour_mb"] == 60.0
+
+    # 依 source 分組時混合兩種用戶端，仍只用有量到位元組的播放時間計算
+    row = rows(c, by=("source",))[("app3.py",)]
+    assert row["play_seconds"] == 180.0
+    assert row["bytes_per_hour_mb"] == 60.0
+
+
+def test_snapshot_grouping_and_percentiles():
+    c = QoECollector()
+    c.ingest("app.py", {"bid": "1", "cc": "desktop-hlsjs", "items": {
+        "a": {"n": "A", "st": [100, 200, 300], "pl": 9000, "rb": 1000, "sc": 1, "fe": 1},
+        "b": {"n": "B", "sw": [400], "pl": 1000},
+    }})
+    c.ingest("app.py", {"bid": "2", "cc": "mobile-native", "items": {"a": {"st": [500], "pl": 1000}}})
+    c.ingest("app2.py", {"bid": "3", "cc": "mobile-native", "items": {"a": {"st": [50]}}})
+
+    by_item = rows(c)
+    assert len(by_item) == 4
+    a = by_item[("app.py", "a", "desktop-hlsjs")]
+    assert a["name"] == "A"
+    assert (a["startup_p50_ms"], a["startup_p90_ms"]) == (200, 300)
+    assert a["rebuffer_ratio"] == 0.1
+    assert a["stalls_per_hour"] == 400.0
+    assert a["error_rate"] == round(1 / 3, 4)
+
+    by_class = rows(c, by=("source", "client_class"))
+    assert set(by_class) == {("app.py", "desktop-hlsjs"), ("app.py", "mobile-native"), ("app2.py", "mobile-native")}
+    desktop = by_class[("app.py", "desktop-hlsjs")]
+    assert "name" not in desktop
+    assert desktop["plays"] == 4
+    assert desktop["switch_p50_ms"] == 400
+    assert desktop["play_seconds"] == 10.0
+
+    # 依 plays 由多到少排序
+    plays = [r["plays"] for r in c.snapshot()]
+    assert plays == sorted(plays, reverse=True)
+
+
+def test_export_writes_json(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "EXPORT_INTERVAL", 0)
+    path = tmp_path / "qoe.json"
+    c = QoECollector(export_path=str(path))
+    c.ingest("app.py", {"bid": "1", "cc": "desktop-hlsjs", "items": {"a": {"pl": 1000}}})
+    data = json.loads(path.read_text(encoding="utf-8"))
+    assert data["by_item"][0]["item"] == "a"
+    assert data["by_client_class"][0]["client_class"] == "desktop-hlsjs"
+    assert [p.name for p in tmp_path.iterdir()] == ["qoe.json"]